@@ -1,54 +1,126 @@
 #!/usr/bin/env python3
 
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+from urllib.parse import urljoin, urlparse, urlsplit
+from urllib.request import getproxies
 import sys
 from concurrent.futures import ThreadPoolExecutor
-from queue import Queue, Empty  # Fix: import Empty explicitly
+from collections import deque
+from functools import partial
+from queue import SimpleQueue
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import threading
 from threading import BoundedSemaphore
-from datetime import datetime
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
 import argparse
+from xml.sax.saxutils import escape
+import asyncio
+
+# One host is crawled, so HTTP/2 multiplexes the requests over a handful of connections
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=30)
+# httpx already asks for gzip and deflate, and adds br whenever the brotli package is installed
+HTTP_HEADERS = {'User-Agent': 'landui-sitemap-bot/1.0'}
+
+def _client_options(transport_cls):
+    """Keyword arguments shared by the httpx.Client and httpx.AsyncClient of the two crawl modes"""
+    # Mounted transports are not given HTTP(S)_PROXY by httpx, so pass it here;
+    # hosts listed in NO_PROXY still go through the client's own, unproxied transport
+    proxies = getproxies()
+    mounts = {
+        f'{scheme}://': transport_cls(http2=True, limits=HTTP_LIMITS, retries=2, proxy=proxies.get(scheme))
+        for scheme in ('http', 'https')
+    }
+    return dict(mounts=mounts, http2=True, limits=HTTP_LIMITS, headers=HTTP_HEADERS, timeout=10.0, follow_redirects=True)
+
+logger = logging.getLogger('crawler')
+
+class _BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler that leaves flushing to the stream's own buffer instead of flushing every record"""
+    def flush(self):
+        pass
+
+def start_logging():
+    """Send the crawler logger through a queue to a background thread, returns the started listener"""
+    # Workers only put records on the queue; the listener thread does all the writing
+    log_queue = SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = QueueListener(log_queue, _BufferedStreamHandler(sys.stdout))
+    listener.start()
+    return listener
+
+# escape() covers &, < and >; the sitemap protocol also wants both quote characters escaped
+_LOC_ENTITIES = {'"': '&quot;', "'": '&apos;'}
+
+def _resolve(base, href):
+    """urljoin() that returns None for an href it cannot parse, e.g. a malformed IPv6 host"""
+    try:
+        return urljoin(base, href)
+    except ValueError:
+        return None
+
 
 class WebCrawler:
+
+    ASYNC_CONCURRENCY = 100  # Coroutines fetching at once in crawl()
+    SITEMAP_BATCH_SIZE = 256  # Buffered <url> entries per file write
+    # One <url> entry of the sitemap, filled in by append_to_sitemap
+    _URL_TMPL = (
+        '    <url>\n'
+        '        <loc>{loc}</loc>\n'
+        '        <lastmod>2012-12-01</lastmod>\n'
+        '        <changefreq>daily</changefreq>\n'
+        '        <priority>0.8</priority>\n'
+        '    </url>\n'
+    )
+
     def __init__(self, base_urls, recursive=False, max_workers=10, max_concurrent_requests=20, sitemap_file='sitemap.xml'):
         self.base_urls = base_urls
         self.recursive = recursive
         self.domain = urlparse(base_urls[0]).netloc  # Using first URL for domain
-        self.visited_urls = set()
-        self.url_queue = Queue()
-        self.url_lock = threading.Lock()
+        self.visited_urls = {}  # UTF-8 bytes keys used as a set; setdefault gives an atomic check-and-insert
+        # One deque shard per worker; append/popleft/pop are atomic, so no queue lock is needed
+        self.queues = [deque() for _ in range(max_workers)]
+        # Per-worker counters, each written only by its own worker, used to detect when the crawl is done
+        self.enqueued = [0] * max_workers
+        self.completed = [0] * max_workers
         self.sitemap_lock = threading.Lock()  # Add lock for sitemap operations
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.semaphore = BoundedSemaphore(max_concurrent_requests)
+        self.max_concurrent_requests = max_concurrent_requests
         self.sitemap_file = sitemap_file
         self.root_urls = set(base_urls)  # Store initial URLs
+        self._roots_tuple = tuple(base_urls)  # str.startswith accepts a tuple and loops in C
         
         # Initialize sitemap file
         self._init_sitemap_file()
         
     def _init_sitemap_file(self):
-        with open(self.sitemap_file, 'w', encoding='utf-8') as f:
-            f.write('<?xml version="1.0" encoding="utf-8"?>\n')
-            f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        # Keep one handle open for the whole crawl; entries are buffered and written in batches
+        self._pending = []
+        self._sitemap_fh = open(self.sitemap_file, 'w', encoding='utf-8')
+        self._sitemap_fh.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self._sitemap_fh.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+    def _flush_pending(self):
+        """Write buffered <url> entries, caller must hold sitemap_lock"""
+        if self._pending:
+            self._sitemap_fh.write(''.join(self._pending))
+            self._pending.clear()
 
     def append_to_sitemap(self, url):
+        # Query strings carry '&', which must be an entity reference in XML
+        block = self._URL_TMPL.format(loc=escape(url, _LOC_ENTITIES))
         with self.sitemap_lock:
-            with open(self.sitemap_file, 'a', encoding='utf-8') as f:
-                f.write('    <url>\n')
-                f.write(f'        <loc>{url}</loc>\n')
-                f.write('        <lastmod>2012-12-01</lastmod>\n')
-                f.write('        <changefreq>daily</changefreq>\n')
-                f.write('        <priority>0.8</priority>\n')
-                f.write('    </url>\n')
+            self._pending.append(block)
+            if len(self._pending) >= self.SITEMAP_BATCH_SIZE:
+                self._flush_pending()
 
     def finalize_sitemap(self):
         with self.sitemap_lock:
-            with open(self.sitemap_file, 'a', encoding='utf-8') as f:
-                f.write('</urlset>')
+            self._flush_pending()
+            self._sitemap_fh.write('</urlset>')
+            self._sitemap_fh.close()
 
     def is_valid_url(self, url):
         try:
@@ -58,92 +130,208 @@ class WebCrawler:
             return False
 
     def is_under_root_urls(self, url):
-        return any(url.startswith(root_url) for root_url in self.base_urls)
+        return url.startswith(self._roots_tuple)
     
+    def _classify(self, full_url):
+        """Return full_url if it is an http(s) link on our domain under the root URLs, else None"""
+        # Cheapest test first: most rejected links are external and fail the prefix check
+        if not self.is_under_root_urls(full_url):
+            return None
+        parts = urlsplit(full_url)
+        if parts.scheme not in ('http', 'https') or parts.netloc != self.domain:
+            return None
+        return full_url
+
     def is_valid_link_to_crawl(self, full_url):
         """验证链接是否需要爬取"""
-        return (
-            urlparse(full_url).netloc == self.domain
-            and self.is_under_root_urls(full_url)
-            and full_url not in self.visited_urls
-        )
+        # Whether it is new is left to mark_visited, whose setdefault is the only visited_urls probe
+        return self._classify(full_url) is not None
 
     def should_process_links(self, url):
         """判断是否需要处理页面中的链接"""
         return self.recursive or url in self.root_urls
 
-    def process_found_link(self, full_url):
+    def mark_visited(self, key):
+        """Record the encoded URL key as visited, returns True only for the first caller to see it"""
+        token = object()
+        return self.visited_urls.setdefault(key, token) is token
+
+    def process_found_link(self, full_url, enqueue):
         """处理发现的新链接"""
-        with self.url_lock:
-            if full_url not in self.visited_urls:
-                self.visited_urls.add(full_url)
-                if self.recursive:
-                    self.url_queue.put(full_url)
-                self.append_to_sitemap(full_url)
-                print(f"Found New Link: {full_url}", flush=True)
-
-    def crawl_worker(self):
-        """Worker that processes URLs from the queue"""
-        while True:
+        key = full_url.encode()  # The one encode per link; the key is what gets stored
+        if self.mark_visited(key):
+            if self.recursive:
+                enqueue(key)
+            self.append_to_sitemap(full_url)
+            logger.info("Found New Link: %s", full_url)
+
+    def enqueue(self, index, key):
+        """Queue the encoded URL key on the shard picked by its hash, counted against worker index"""
+        # Counted before it is published, so a URL can never be completed before it is enqueued
+        self.enqueued[index] += 1
+        self.queues[hash(key) % len(self.queues)].append(key)
+
+    def next_url(self, index):
+        """Take the oldest key from the worker's own shard, or steal the newest from another one"""
+        shards = self.queues
+        try:
+            return shards[index].popleft()
+        except IndexError:
+            pass
+        for offset in range(1, len(shards)):
             try:
-                url = self.url_queue.get(timeout=1)  # 1 second timeout
-                self.process_url(url)
-                self.url_queue.task_done()
-            except Empty:  # Fix: use Empty instead of Queue.Empty
-                break
+                return shards[(index + offset) % len(shards)].pop()
+            except IndexError:
+                continue
+        return None
+
+    def is_drained(self):
+        """True once every URL enqueued so far has been processed"""
+        # The counters only grow; reading the completions first means the sums can only be
+        # equal if, at some instant in between, nothing was queued or being processed
+        completed = sum(self.completed)
+        return completed == sum(self.enqueued)
+
+    def crawl_worker(self, index):
+        """Worker that processes URLs from its own shard"""
+        enqueue = partial(self.enqueue, index)
+        while not self.crawl_done.is_set():
+            key = self.next_url(index)
+            if key is None:
+                if self.is_drained():
+                    self.crawl_done.set()
+                else:
+                    self.crawl_done.wait(0.05)  # Other workers may still be producing links
+                continue
+            try:
+                self.process_url(key, enqueue)
+            finally:
+                self.completed[index] += 1
 
     def crawl_parallel(self):
+        # The client, the request limit and threads are only needed by the threaded crawl
+        self.client = httpx.Client(**_client_options(httpx.HTTPTransport))  # Thread-safe, shared by all workers
+        self.crawl_done = threading.Event()  # Set by the first worker that finds the crawl drained
+        self.semaphore = BoundedSemaphore(self.max_concurrent_requests)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.queues))
+
         # Add root URLs to queue
         for url in self.base_urls:
-            self.url_queue.put(url)
-            self.visited_urls.add(url)
+            if not self.is_valid_url(url):
+                continue
+            key = url.encode()  # URLs are stored as bytes from here on
+            self.enqueue(0, key)
+            self.mark_visited(key)
 
-        # Create and start worker threads
+        # Create and start worker threads, one per shard
         workers = []
-       
-        future = self.executor.submit(self.crawl_worker)
-        workers.append(future)
+        for index in range(len(self.queues)):
+            future = self.executor.submit(self.crawl_worker, index)
+            workers.append(future)
 
         # Wait for all workers to complete
         for worker in workers:
             worker.result()
         
         self.executor.shutdown()
+        self.client.close()
 
-    def process_url(self, url):
-        if not self.is_valid_url(url) or not self.is_under_root_urls(url):
-            return
+    async def crawl(self):
+        """asyncio alternative to crawl_parallel: coroutines on one event loop share an AsyncClient"""
+        url_queue = asyncio.Queue()
+        for url in self.base_urls:
+            if not self.is_valid_url(url):
+                continue
+            key = url.encode()  # URLs are stored as bytes from here on
+            url_queue.put_nowait(key)
+            self.mark_visited(key)
 
-        with self.semaphore:
+        async with httpx.AsyncClient(**_client_options(httpx.AsyncHTTPTransport)) as client:
+            # A fixed number of worker coroutines bounds concurrency the way the semaphore does for threads
+            workers = [
+                asyncio.create_task(self.async_worker(client, url_queue))
+                for _ in range(self.ASYNC_CONCURRENCY)
+            ]
+            await url_queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def async_worker(self, client, url_queue):
+        """Coroutine that processes URLs from the asyncio queue"""
+        while True:
+            key = await url_queue.get()
             try:
-                response = requests.get(url, timeout=10)
-                if response.status_code != 200:
-                    return
+                await self.process_url_async(client, key, url_queue.put_nowait)
+            finally:
+                url_queue.task_done()
 
-                soup = BeautifulSoup(response.text, 'html.parser')
-                self.append_to_sitemap(url)
+    def fetch_page(self, url):
+        """Return the raw body of url, or None unless the response is 200"""
+        response = self.client.get(url)  # Reads the whole body and frees the stream
+        if response.status_code != 200:
+            return None
+        return response.content
 
-                if not self.should_process_links(url):
-                    return
+    async def fetch_page_async(self, client, url):
+        """Async counterpart of fetch_page"""
+        response = await client.get(url)
+        if response.status_code != 200:
+            return None
+        return response.content
 
-                for link in soup.find_all('a'):
-                    href = link.get('href')
-                    if not href:
-                        continue
-                        
-                    full_url = urljoin(url, href)
-                    if self.is_valid_link_to_crawl(full_url):
-                        self.process_found_link(full_url)
+    def process_url(self, key, enqueue):
+        # Queued URLs were already validated when they were seeded or by _classify
+        url = key.decode()
+        with self.semaphore:
+            try:
+                body = self.fetch_page(url)
+                if body is not None:
+                    self.process_page(url, body, enqueue)
 
             except Exception as e:
                 print(f"Error crawling {url}: {str(e)}", file=sys.stderr)
 
+    async def process_url_async(self, client, key, enqueue):
+        url = key.decode()
+        try:
+            body = await self.fetch_page_async(client, url)
+            if body is not None:
+                # Parsing stays synchronous; it is cheap next to the network wait
+                self.process_page(url, body, enqueue)
+        except Exception as e:
+            print(f"Error crawling {url}: {str(e)}", file=sys.stderr)
+
+    def process_page(self, url, body, enqueue):
+        """Add a fetched page to the sitemap and pass its new links to enqueue"""
+        self.append_to_sitemap(url)
+
+        if not self.should_process_links(url):
+            return
+
+        # Pages whose links are skipped are never parsed; the DOM is dropped once hrefs are extracted
+        # The undecoded bytes go straight in; lexbor detects the charset from a BOM or <meta charset>
+        tree = LexborHTMLParser(body, encoding=True)
+        hrefs = [node.attributes.get('href') for node in tree.css('a[href]')]
+        del tree
+
+        # Nav/footer anchors repeat many times per page: resolve each distinct href once, then
+        # dedupe the results, since different hrefs can name the same URL; page order is kept
+        abs_urls = [_resolve(url, href) for href in dict.fromkeys(hrefs) if href]
+        page_urls = dict.fromkeys(abs_urls)
+        page_urls.pop(None, None)  # Malformed hrefs only drop themselves
+        for full_url in page_urls:
+            if self.is_valid_link_to_crawl(full_url):
+                self.process_found_link(full_url, enqueue)
+
 def main():
     parser = argparse.ArgumentParser(description='Web crawler for generating sitemap')
     parser.add_argument('--recursive', '-r', action='store_true',
                       help='Enable recursive crawling (include child links)')
     parser.add_argument('--output', '-o', default='sitemap.xml',
                       help='Output sitemap file name')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                      help='Crawl with asyncio coroutines instead of worker threads')
     args = parser.parse_args()
 
     base_urls = [
@@ -154,10 +342,14 @@ def main():
     ]
     
     print(f"Starting {'recursive' if args.recursive else 'non-recursive'} crawl for all base URLs")
+    listener = start_logging()
     crawler = WebCrawler(base_urls, recursive=args.recursive, sitemap_file=args.output)
-    crawler.crawl_parallel()
+    if args.use_async:
+        asyncio.run(crawler.crawl())
+    else:
+        crawler.crawl_parallel()
     crawler.finalize_sitemap()  # Close the XML structure
-    crawler.executor.shutdown()
+    listener.stop()  # Writes out the queued messages before the summary below
     
     print("\nCrawling completed!")
     print(f"Total unique URLs found: {len(crawler.visited_urls)}")